@@ -171,17 +171,22 @@ class PennyPetConfig:
             return pd.DataFrame()
         
         try:
+            # Listes de codes converties une fois en frozenset (appartenance en O(1))
             for col in ["exclusions", "actes_couverts", "conditions_speciales"]:
                 if col in df.columns:
-                    df[col] = (
-                        df[col]
-                        .fillna("")
-                        .apply(lambda s: [v.strip() for v in str(s).split("|") if v.strip()] if s else [])
-                    )
+                    df[col] = [
+                        frozenset(v.strip() for v in re.split(r"[|,]", str(s)) if v.strip()) if s else frozenset()
+                        for s in df[col].fillna("").tolist()
+                    ]
             
             for col in ["taux_remboursement", "plafond_annuel"]:
                 if col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            
+            # Colonnes de filtrage en category : les comparaisons portent sur des codes entiers
+            for col in ["formule", "code_acte", "type_couverture"]:
+                if col in df.columns:
+                    df[col] = df[col].astype("category")
         except Exception as e:
             logger.error(f"Erreur traitement règles {relpath}: {e}")
         
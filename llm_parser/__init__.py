@@ -1,3 +1,3 @@
-from .pennypet_processor import PennyPetProcessor, pennypet_processor
+from .pennypet_processor import PennyPetProcessor, get_pennypet_processor
 
-__all__ = ["PennyPetProcessor", "pennypet_processor"]
+__all__ = ["PennyPetProcessor", "get_pennypet_processor"]
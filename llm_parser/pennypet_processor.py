@@ -1,8 +1,14 @@
+import copy
+import functools
+import hashlib
 import json
+import math
 import re
 import logging
+import threading
 import pandas as pd
-from typing import Dict, List, Any, Tuple, Optional
+from collections import OrderedDict
+from typing import Dict, List, Any, Iterator, Tuple, Optional
 from config.pennypet_config import PennyPetConfig
 from openrouter_client import OpenRouterClient
 import unicodedata
@@ -26,13 +32,108 @@ except ImportError:
     RAPIDFUZZ_AVAILABLE = False
     logger.warning("RapidFuzz non disponible, fuzzy matching désactivé")
 
-def _strip_accents(txt: str) -> str:
-    """Supprime les accents et normalise le texte"""
-    if not txt: 
-        return ""
-    txt = unicodedata.normalize("NFD", txt)
-    txt = "".join(c for c in txt if unicodedata.category(c) != "Mn")
-    return re.sub(r"[^\w\s]", " ", txt).lower().strip()
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.info("orjson non disponible, parsing JSON via la bibliothèque standard")
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+    logger.info("pyahocorasick non disponible, recherche des termes d'actes par regex")
+
+# Score RapidFuzz minimal pour rattacher un libellé au glossaire pharmaceutique
+SEUIL_FUZZY_MEDICAMENTS = 85
+
+# Nettoyage du pseudo-JSON renvoyé par les LLM (compilé une fois au chargement du module)
+_CLE_NON_QUOTEE_RE = re.compile(r'([{,]\s*)([a-zA-Z0-9_]+)\s*:')
+_VIRGULE_AVANT_FERMANTE_RE = re.compile(r',\s*([}\]])')
+# Objets collés, tableaux collés et virgules multiples réparés en une seule passe
+_SEPARATEURS_RE = re.compile(r'(}\s*{)|(]\s*\[)|(,,+)')
+_SEPARATEURS_REPARES = {1: '},{', 2: '],[', 3: ','}
+
+# Décodeur réutilisé pour raw_decode (décode l'objet racine et ignore le texte qui suit)
+_JSON_DECODER = json.JSONDecoder()
+
+# Fallback regex : lignes « libellé / montant » par ordre de priorité et informations client
+_LIGNES_FALLBACK_RES = tuple(re.compile(p, re.IGNORECASE | re.DOTALL) for p in (
+    r'"?(?:code_acte|acte)"?\s*[:=]\s*"([^"]+)"[^}]*"?(?:montant_ht|montant)"?\s*[:=]\s*([\d.]+)',
+    r'"?(?:description|desc)"?\s*[:=]\s*"([^"]+)"[^}]*"?(?:montant_ht|montant)"?\s*[:=]\s*([\d.]+)',
+))
+# Dernier recours « libellé : montant » : caractères structurants ou séparateur suivi d'un montant,
+# parcourus une seule fois (le libellé est le texte depuis le repère précédent)
+_LIGNE_GENERIQUE_RE = re.compile(r'([{}"])|[:=]\s*([\d.]+)')
+_CLIENT_FALLBACK_RES = {
+    "nom_proprietaire": re.compile(r'"?(?:proprietaire|owner|nom)"?\s*[:=]\s*"([^"]+)"', re.IGNORECASE),
+    "nom_animal": re.compile(r'"?(?:animal|pet|nom_animal)"?\s*[:=]\s*"([^"]+)"', re.IGNORECASE),
+    "identification": re.compile(r'"?(?:identification|id|puce)"?\s*[:=]\s*"([^"]+)"', re.IGNORECASE)
+}
+
+# Ponctuation et symboles remplacés par des espaces lors de la normalisation
+_NON_MOT_RE = re.compile(r'[^\w\s]')
+
+# Caractères structurants pour le suivi des accolades en streaming
+_JETONS_JSON_RE = re.compile(r'[{}"\\]')
+
+# Dosage explicite (« 250 mg », « 5 ml »…) : indice le moins coûteux d'un médicament
+_DOSE_RE = re.compile(r'\b\d+\s*(?:mg|ml|g|l|ui|iu|mcg|µg|mg/ml|ui/ml)\b', re.IGNORECASE)
+
+# Mots-clés signalant un accident dans un libellé (une seule passe, sans copie en minuscules)
+_ACCIDENT_RE = re.compile(r'accident|urgen(?:t|ce)|fract|trauma', re.IGNORECASE)
+
+# Patterns de classification des libellés (texte déjà passé par normaliser_accents)
+PATTERNS_MEDICAMENTS = (
+    r'\b\d+\s*(?:mg|ml|g|l|ui|iu|mcg|µg|mg/ml|ui/ml)\b',
+    r'\b(?:comprimé|gélule|cp|gél|sol|inj|ampoule|flacon|tube|boîte|sachet|pipette)\.?\s*\d*',
+    r'\b(?:antibiotic|anti-inflammatoire|antiparasitaire|antifongique|antiviral|vermifuge)\b',
+    r'\b(?:vaccin|vaccination|rappel|primo-vaccination|sérum|immunoglobuline)\b',
+    r'\b(?:seringue|pipette|spray|pommade|crème|lotion|collyre|gouttes)\b',
+    r'\b\d+\s*x\s*\d+\s*(?:mg|ml|g|l|cp|gél)\b',
+    r'\b(?:principe|actif|laboratoire|generique|specialite|marque)\b',
+    r'\b(?:anesthé|analg|cortico|hormon|vitamin|mineral|complément)\w*\b'
+)
+PATTERNS_ACTES = (
+    r'\b(?:consultation|examen|visite|contrôle|bilan)\b',
+    r'\b(?:chirurgie|opération|intervention|anesthésie)\b',
+    r'\b(?:radio|échographie|scanner|irm|endoscopie)\b',
+    r'\b(?:analyse|prélèvement|biopsie|cytologie)\b',
+    r'\b(?:hospitalisation|perfusion|soin|pansement)\b'
+)
+# Alternations uniques compilées une fois au chargement du module
+_MEDICAMENTS_RE = re.compile("|".join(f"(?:{p})" for p in PATTERNS_MEDICAMENTS), re.IGNORECASE)
+_ACTES_RE = re.compile("|".join(f"(?:{p})" for p in PATTERNS_ACTES), re.IGNORECASE)
+
+# Types de sinistres couverts (masque de bits, cf. type_couverture des règles)
+COUVERTURE_MALADIE = 0b01
+COUVERTURE_ACCIDENT = 0b10
+
+# Barème par formule : (taux de remboursement, plafond en €, masque de couverture)
+BAREMES_PENNYPET: Dict[str, Tuple[float, float, int]] = {
+    "START": (0.0, 0.0, 0),
+    "PREMIUM": (1.0, 500.0, COUVERTURE_ACCIDENT),
+    "INTEGRAL": (0.5, 1000.0, COUVERTURE_ACCIDENT | COUVERTURE_MALADIE),
+    "INTEGRAL_PLUS": (1.0, 1000.0, COUVERTURE_ACCIDENT | COUVERTURE_MALADIE),
+}
+
+# Masque de couverture associé à la colonne type_couverture de regles_prise_en_charge.csv
+TYPES_COUVERTURE = {
+    "AUCUNE": 0,
+    "ACCIDENT_SEULEMENT": COUVERTURE_ACCIDENT,
+    "ACCIDENT_MALADIE": COUVERTURE_ACCIDENT | COUVERTURE_MALADIE,
+}
+
+# Nombre de résultats de factures conservés en mémoire (clé = hash du contenu)
+TAILLE_CACHE_RESULTATS = 128
+
+# Nombre de libellés normalisés conservés par le normaliseur (éviction LRU)
+TAILLE_CACHE_NORMALISATION = 4096
+
+# Nombre de textes mémorisés par normaliser_accents (libellés et clés du glossaire)
+TAILLE_CACHE_ACCENTS = 8192
 
 def _insert_comma_at_error(text: str, pos: int) -> str:
     """Insère une virgule à la position d'erreur JSON"""
@@ -43,10 +144,11 @@ def _insert_comma_at_error(text: str, pos: int) -> str:
 def parse_llm_json(raw: str) -> Dict[str, Any]:
     """
     Parser JSON ultra-robuste avec réparation automatique
-    1) Isole le JSON {…}
+    1) Isole le JSON {…} et le décode tel quel s'il est déjà valide (orjson, puis raw_decode)
     2) Nettoie clés non-quotées et guillemets simples  
-    3) Boucle de réparation : json.loads → insert comma at pos → retry
-    4) Fallback minimal par regex
+    3) Chemin rapide orjson si disponible
+    4) Boucle de réparation : json.loads → insert comma at pos → retry
+    5) Fallback minimal par regex
     """
     # 1. Isolation du JSON
     start, end = raw.find('{'), raw.rfind('}') + 1
@@ -55,15 +157,38 @@ def parse_llm_json(raw: str) -> Dict[str, Any]:
     
     txt = raw[start:end]
     
+    # JSON déjà valide : décodé sans nettoyage (qui altérerait apostrophes et « x: » dans les chaînes)
+    if ORJSON_AVAILABLE:
+        try:
+            data = orjson.loads(txt)
+            logger.info("JSON parsé avec succès (orjson, sans nettoyage)")
+            return data
+        except orjson.JSONDecodeError:
+            pass
+    try:
+        # raw_decode s'arrête à la fin de l'objet racine, même si du texte contenant '}' suit
+        data, _ = _JSON_DECODER.raw_decode(raw, start)
+        logger.info("JSON parsé avec succès (sans nettoyage)")
+        return data
+    except json.JSONDecodeError:
+        pass
+    
     # 2. Nettoyage de base
-    txt = re.sub(r'([{,]\s*)([a-zA-Z0-9_]+)\s*:', r'\1"\2":', txt)  # Clés non quotées
+    txt = _CLE_NON_QUOTEE_RE.sub(r'\1"\2":', txt)  # Clés non quotées
     txt = txt.replace("'", '"')  # Guillemets simples
-    txt = re.sub(r',\s*([}\]])', r'\1', txt)  # Virgules avant fermantes
-    txt = re.sub(r'}\s*{', '},{', txt)  # Objects collés
-    txt = re.sub(r']\s*\[', '],[', txt)  # Arrays collés
-    txt = re.sub(r',,+', ',', txt)  # Doubles virgules
+    txt = _VIRGULE_AVANT_FERMANTE_RE.sub(r'\1', txt)  # Virgules avant fermantes
+    txt = _SEPARATEURS_RE.sub(lambda m: _SEPARATEURS_REPARES[m.lastindex], txt)  # Objets/arrays collés, doubles virgules
+    
+    # 3. Chemin rapide : JSON déjà valide après nettoyage
+    if ORJSON_AVAILABLE:
+        try:
+            data = orjson.loads(txt)
+            logger.info("JSON parsé avec succès (orjson)")
+            return data
+        except orjson.JSONDecodeError:
+            pass  # la boucle de réparation s'appuie sur les messages d'erreur de json
     
-    # 3. Boucle de réparation avec insertion de virgules
+    # 4. Boucle de réparation avec insertion de virgules
     max_attempts = 10
     for attempt in range(max_attempts):
         try:
@@ -78,29 +203,103 @@ def parse_llm_json(raw: str) -> Dict[str, Any]:
                 logger.warning(f"Erreur JSON non réparable: {e}")
                 break
     
-    # 4. Fallback par regex
+    # 5. Fallback par regex
     logger.warning("Utilisation du parser de fallback")
     return _fallback_regex_parser(raw)
 
+class _DetecteurFinJSON:
+    """Suit la profondeur des accolades au fil des fragments (chaînes JSON comprises)"""
+    
+    def __init__(self):
+        self.profondeur = 0
+        self.demarre = False
+        self.dans_chaine = False
+        self.echappe = False
+    
+    def alimenter(self, fragment: str) -> int:
+        """Renvoie l'index (dans le fragment) de l'accolade fermant l'objet racine, ou -1"""
+        pos = 0
+        if self.echappe:
+            if not fragment:
+                return -1
+            # Caractère échappé en tête de fragment (barre oblique en fin du précédent)
+            self.echappe = False
+            pos = 1
+        # Saut direct d'un caractère structurant au suivant : le reste du texte est parcouru en C
+        while True:
+            jeton = _JETONS_JSON_RE.search(fragment, pos)
+            if jeton is None:
+                return -1
+            i = jeton.start()
+            ch = fragment[i]
+            pos = i + 1
+            if self.dans_chaine:
+                if ch == "\\":
+                    if pos < len(fragment):
+                        pos += 1
+                    else:
+                        self.echappe = True
+                elif ch == '"':
+                    self.dans_chaine = False
+            elif ch == '"':
+                if self.demarre:
+                    self.dans_chaine = True
+            elif ch == "{":
+                self.profondeur += 1
+                self.demarre = True
+            elif ch == "}" and self.demarre:
+                self.profondeur -= 1
+                if self.profondeur == 0:
+                    return i
+
+def _lire_json_en_flux(fragments: Iterator[str]) -> str:
+    """
+    Accumule une réponse LLM streamée et s'arrête dès que l'objet JSON racine
+    est refermé ; le reste du flux est annulé (fermeture de la réponse HTTP).
+    """
+    detecteur = _DetecteurFinJSON()
+    morceaux: List[str] = []
+    try:
+        for fragment in fragments:
+            fin = detecteur.alimenter(fragment)
+            if fin >= 0:
+                morceaux.append(fragment[:fin + 1])
+                break
+            morceaux.append(fragment)
+    finally:
+        close = getattr(fragments, "close", None)
+        if close:
+            close()
+    return "".join(morceaux)
+
+def _lignes_generiques(txt: str) -> List[Tuple[str, str]]:
+    """Paires (libellé, montant) « texte : 12.5 », en temps linéaire"""
+    # Mêmes paires (aux espaces près) que findall(r'([^{}"]+?)\s*[:=]\s*([\d.]+)'), sans relancer un scan paresseux
+    # depuis chaque position (quadratique sur une longue réponse sans séparateur)
+    paires = []
+    debut = 0
+    for m in _LIGNE_GENERIQUE_RE.finditer(txt):
+        if m.group(1):
+            debut = m.end()
+        elif m.start() > debut:
+            paires.append((txt[debut:m.start()], m.group(2)))
+            debut = m.end()
+    return paires
+
 def _fallback_regex_parser(txt: str) -> Dict[str, Any]:
     """Parser de fallback par regex pour cas désespérés"""
-    # Extraction des lignes avec patterns flexibles
-    patterns = [
-        r'"?(?:code_acte|acte)"?\s*[:=]\s*"([^"]+)"[^}]*"?(?:montant_ht|montant)"?\s*[:=]\s*([\d.]+)',
-        r'"?(?:description|desc)"?\s*[:=]\s*"([^"]+)"[^}]*"?(?:montant_ht|montant)"?\s*[:=]\s*([\d.]+)',
-        r'([^{}"]+?)\s*[:=]\s*([\d.]+)'
-    ]
-    
+    # Extraction des lignes : le premier extracteur qui trouve quelque chose l'emporte
     lines = []
-    for pattern in patterns:
-        matches = re.findall(pattern, txt, re.IGNORECASE | re.DOTALL)
+    extracteurs = [pattern.findall for pattern in _LIGNES_FALLBACK_RES] + [_lignes_generiques]
+    for extraire in extracteurs:
+        matches = extraire(txt)
         if matches:
-            for match in matches:
+            for libelle, montant in matches:
                 try:
                     lines.append({
-                        "code_acte": match[0].strip(),
-                        "description": match[0].strip(),
-                        "montant_ht": float(match[1])
+                        "code_acte": libelle.strip(),
+                        "description": libelle.strip(),
+                        "montant_ht": float(montant)
                     })
                 except ValueError:
                     continue
@@ -111,14 +310,8 @@ def _fallback_regex_parser(txt: str) -> Dict[str, Any]:
     
     # Extraction informations client
     client_info = {}
-    client_patterns = {
-        "nom_proprietaire": r'"?(?:proprietaire|owner|nom)"?\s*[:=]\s*"([^"]+)"',
-        "nom_animal": r'"?(?:animal|pet|nom_animal)"?\s*[:=]\s*"([^"]+)"',
-        "identification": r'"?(?:identification|id|puce)"?\s*[:=]\s*"([^"]+)"'
-    }
-    
-    for key, pattern in client_patterns.items():
-        match = re.search(pattern, txt, re.IGNORECASE)
+    for key, pattern in _CLIENT_FALLBACK_RES.items():
+        match = pattern.search(txt)
         if match:
             client_info[key] = match.group(1).strip()
     
@@ -127,17 +320,42 @@ def _fallback_regex_parser(txt: str) -> Dict[str, Any]:
     return {
         "lignes": lines,
         "montant_total": total,
-        "informations_client": client_info
+        "informations_client": client_info,
+        # Extraction approximative : signalée pour ne pas la mettre en cache
+        "parsing_degrade": True
     }
 
+def _construire_table_accents() -> Dict[int, Optional[str]]:
+    """Table str.translate équivalente à NFD + suppression des Mn pour l'alphabet latin"""
+    table: Dict[int, Optional[str]] = {}
+    for code in range(0xC0, 0x250):  # Latin-1, Latin étendu A et B
+        lettre = chr(code)
+        base = ''.join(c for c in unicodedata.normalize('NFD', lettre) if unicodedata.category(c) != 'Mn')
+        if base != lettre:
+            table[code] = base
+    for code in range(0x300, 0x370):  # diacritiques combinants (texte déjà décomposé)
+        table[code] = None
+    return table
+
+_TABLE_ACCENTS = _construire_table_accents()
+
+@functools.lru_cache(maxsize=TAILLE_CACHE_ACCENTS)
 def normaliser_accents(texte: str) -> str:
     """Normalise les accents et caractères spéciaux"""
     if not texte:
         return ""
     
-    texte_nfd = unicodedata.normalize('NFD', texte)
-    texte_sans_accents = ''.join(c for c in texte_nfd if unicodedata.category(c) != 'Mn')
-    texte_clean = re.sub(r'[^\w\s]', ' ', texte_sans_accents.lower())
+    # Texte ASCII (cas courant) : ni accents ni marques combinantes, décomposition inutile
+    if texte.isascii():
+        texte_sans_accents = texte
+    else:
+        # Accents latins retirés en une passe C ; décomposition complète seulement
+        # s'il reste des caractères hors table (grec, ligatures…)
+        texte_sans_accents = texte.translate(_TABLE_ACCENTS)
+        if not texte_sans_accents.isascii():
+            texte_nfd = unicodedata.normalize('NFD', texte_sans_accents)
+            texte_sans_accents = ''.join(c for c in texte_nfd if unicodedata.category(c) != 'Mn')
+    texte_clean = _NON_MOT_RE.sub(' ', texte_sans_accents.lower())
     
     return ' '.join(texte_clean.split())
 
@@ -146,14 +364,19 @@ class NormaliseurAMVAmeliore:
     
     def __init__(self, config: PennyPetConfig):
         self.config = config
-        self.cache: Dict[str, Optional[str]] = {}
+        # Cache LRU borné libellé → code, partagé entre threads
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
         
         # Récupération sécurisée de tous les DataFrames
         self.termes_actes = self._get_termes_actes_safe(config)
         self.actes_df = self._get_actes_df_safe(config)
         
         # Glossaire pharmaceutique
-        self.termes_medicaments = getattr(config, 'glossaire_pharmaceutique', set())
+        # Figé une fois construit : la casse est traitée par normaliser_accents dans _preprocess_glossaire
+        self.termes_medicaments = frozenset(t for t in getattr(config, 'glossaire_pharmaceutique', ()) if t)
         self.medicaments_df = getattr(config, 'medicaments_df', pd.DataFrame())
         self.mapping_amv = getattr(config, 'mapping_amv', {})
         
@@ -167,26 +390,34 @@ class NormaliseurAMVAmeliore:
         
         # Préprocessage
         self.glossaire_normalise = self._preprocess_glossaire()
+        # Choix du fuzzy matching matérialisés une fois (au lieu d'un list() par appel)
+        self._glossaire_cles: List[str] = list(self.glossaire_normalise.keys())
+        # Automate des clés du glossaire : une clé présente telle quelle dans le libellé
+        # donne un partial_ratio de 100, inutile alors de lancer le fuzzy matching
+        self._automate_glossaire = None
+        if self._glossaire_cles and AHOCORASICK_AVAILABLE:
+            self._automate_glossaire = ahocorasick.Automaton()
+            for terme_norm in self._glossaire_cles:
+                self._automate_glossaire.add_word(terme_norm, terme_norm)
+            self._automate_glossaire.make_automaton()
+        
+        # Termes d'actes (recherche de sous-chaîne) : automate Aho-Corasick (un seul
+        # passage quel que soit le nombre de termes), sinon alternation triée du plus long au plus court
+        self._automate_termes_actes = None
+        self._regex_termes_actes = None
+        if self.termes_actes and AHOCORASICK_AVAILABLE:
+            self._automate_termes_actes = ahocorasick.Automaton()
+            for terme in self.termes_actes:
+                self._automate_termes_actes.add_word(terme, terme)
+            self._automate_termes_actes.make_automaton()
+        elif self.termes_actes:
+            self._regex_termes_actes = re.compile(
+                "|".join(re.escape(t) for t in sorted(self.termes_actes, key=len, reverse=True))
+            )
         
-        # Patterns regex étendus
-        self.patterns_medicaments = [
-            r'\b\d+\s*(mg|ml|g|l|ui|iu|mcg|µg|mg/ml|ui/ml)\b',
-            r'\b(comprimé|gélule|cp|gél|sol|inj|ampoule|flacon|tube|boîte|sachet|pipette)\.?\s*\d*',
-            r'\b(antibiotic|anti-inflammatoire|antiparasitaire|antifongique|antiviral|vermifuge)\b',
-            r'\b(vaccin|vaccination|rappel|primo-vaccination|sérum|immunoglobuline)\b',
-            r'\b(seringue|pipette|spray|pommade|crème|lotion|collyre|gouttes)\b',
-            r'\b\d+\s*x\s*\d+\s*(mg|ml|g|l|cp|gél)\b',
-            r'\b(principe|actif|laboratoire|generique|specialite|marque)\b',
-            r'\b(anesthé|analg|cortico|hormon|vitamin|mineral|complément)\w*\b'
-        ]
-        
-        self.patterns_actes = [
-            r'\b(consultation|examen|visite|contrôle|bilan)\b',
-            r'\b(chirurgie|opération|intervention|anesthésie)\b',
-            r'\b(radio|échographie|scanner|irm|endoscopie)\b',
-            r'\b(analyse|prélèvement|biopsie|cytologie)\b',
-            r'\b(hospitalisation|perfusion|soin|pansement)\b'
-        ]
+        # Alternations uniques compilées au chargement du module (PATTERNS_MEDICAMENTS, PATTERNS_ACTES)
+        self._regex_medicaments = _MEDICAMENTS_RE
+        self._regex_actes = _ACTES_RE
         
         # Variantes orthographiques
         self.variantes = {
@@ -201,17 +432,17 @@ class NormaliseurAMVAmeliore:
         
         logger.info(f"Normaliseur initialisé: {len(self.termes_actes)} actes, {len(self.termes_medicaments)} médicaments")
 
-    def _get_termes_actes_safe(self, config: PennyPetConfig) -> set:
-        """Récupère les termes d'actes depuis tous les fichiers"""
+    def _get_termes_actes_safe(self, config: PennyPetConfig) -> frozenset:
+        """Récupère les termes d'actes (en minuscules) depuis tous les fichiers"""
         termes = set()
         
         try:
-            # Depuis actes_df
+            # Depuis actes_df (valeurs distinctes via unique(), minuscules sur celles-ci seulement)
             if hasattr(config, 'actes_df') and not config.actes_df.empty:
                 df = config.actes_df
                 for col in ['field_label', 'label', 'acte', 'description', 'libelle']:
                     if col in df.columns:
-                        termes.update(df[col].dropna().astype(str).str.lower())
+                        termes.update(map(str.lower, df[col].dropna().astype(str).unique()))
                         break
             
             # Depuis calculs_codes_df
@@ -219,14 +450,16 @@ class NormaliseurAMVAmeliore:
                 df = config.calculs_codes_df
                 for col in ['field_label', 'description', 'code']:
                     if col in df.columns:
-                        termes.update(df[col].dropna().astype(str).str.lower())
+                        termes.update(map(str.lower, df[col].dropna().astype(str).unique()))
             
             logger.info(f"Total termes d'actes: {len(termes)}")
             
         except Exception as e:
             logger.error(f"Erreur extraction termes actes: {e}")
         
-        return termes
+        # Ensemble figé, sans terme vide (qui reconnaîtrait n'importe quel libellé)
+        termes.discard("")
+        return frozenset(termes)
 
     def _get_actes_df_safe(self, config: PennyPetConfig) -> pd.DataFrame:
         """Récupère le DataFrame des actes"""
@@ -247,17 +480,16 @@ class NormaliseurAMVAmeliore:
         try:
             # Glossaire principal
             for terme in self.termes_medicaments:
-                if terme:
-                    terme_norm = normaliser_accents(str(terme))
-                    if terme_norm:
-                        glossaire_normalise[terme_norm] = terme
+                terme_norm = normaliser_accents(str(terme))
+                if terme_norm:
+                    glossaire_normalise[terme_norm] = terme
             
-            # Depuis medicaments_df
+            # Depuis medicaments_df (valeurs distinctes seulement, les doublons donnent la même entrée)
             if not self.medicaments_df.empty and 'medicament' in self.medicaments_df.columns:
-                for medicament in self.medicaments_df['medicament'].dropna():
-                    terme_norm = normaliser_accents(str(medicament))
+                for medicament in self.medicaments_df['medicament'].dropna().astype(str).unique():
+                    terme_norm = normaliser_accents(medicament)
                     if terme_norm:
-                        glossaire_normalise[terme_norm] = str(medicament)
+                        glossaire_normalise[terme_norm] = medicament
                         
         except Exception as e:
             logger.error(f"Erreur préprocessing: {e}")
@@ -265,21 +497,62 @@ class NormaliseurAMVAmeliore:
         logger.info(f"Glossaire: {len(glossaire_normalise)} entrées")
         return glossaire_normalise
 
-    def _detecter_patterns_medicaments(self, texte: str) -> bool:
-        """Détecte les patterns de médicaments"""
-        try:
-            texte_norm = normaliser_accents(texte)
-            return any(re.search(pattern, texte_norm, re.IGNORECASE) for pattern in self.patterns_medicaments)
-        except:
-            return False
+    def _detecter_patterns_medicaments(self, texte_norm: str) -> bool:
+        """Détecte les patterns de médicaments (texte déjà passé par normaliser_accents)"""
+        return self._regex_medicaments.search(texte_norm) is not None
 
-    def _detecter_patterns_actes(self, texte: str) -> bool:
-        """Détecte les patterns d'actes"""
-        try:
-            texte_norm = normaliser_accents(texte)
-            return any(re.search(pattern, texte_norm, re.IGNORECASE) for pattern in self.patterns_actes)
-        except:
+    def _detecter_patterns_actes(self, texte_norm: str) -> bool:
+        """Détecte les patterns d'actes (texte déjà passé par normaliser_accents)"""
+        return self._regex_actes.search(texte_norm) is not None
+
+    def _contient_terme_acte(self, texte_norm: str) -> bool:
+        """Vrai si le texte contient l'un des termes d'actes"""
+        if self._automate_termes_actes is not None:
+            return next(self._automate_termes_actes.iter(texte_norm), None) is not None
+        if self._regex_termes_actes is not None:
+            return self._regex_termes_actes.search(texte_norm) is not None
+        return False
+
+    def _contient_cle_glossaire(self, texte_norm: str) -> bool:
+        """Vrai si le texte contient littéralement une clé du glossaire (automate requis)"""
+        if self._automate_glossaire is None:
             return False
+        return next(self._automate_glossaire.iter(texte_norm), None) is not None
+
+    def _cache_lire(self, cle: str) -> Optional[str]:
+        """Lecture du cache LRU (le libellé lu devient le plus récent)"""
+        with self._cache_lock:
+            code = self.cache.get(cle)
+            if code is None:
+                self._cache_misses += 1
+                return None
+            self.cache.move_to_end(cle)
+            self._cache_hits += 1
+            return code
+
+    def _cache_ecrire(self, cle: str, code: str) -> None:
+        """Écriture dans le cache LRU avec éviction du plus ancien au-delà de la taille max"""
+        with self._cache_lock:
+            self.cache[cle] = code
+            self.cache.move_to_end(cle)
+            if len(self.cache) > TAILLE_CACHE_NORMALISATION:
+                self.cache.popitem(last=False)
+
+    def _classer_sans_fuzzy(self, libelle_norm: str) -> Optional[str]:
+        """Étapes déterministes (patterns, glossaire, termes d'actes) ; None si non résolu"""
+        # 1. Détection médicaments, du moins coûteux au plus coûteux :
+        # entrée exacte du glossaire (dict), dosage explicite, puis patterns
+        if (libelle_norm in self.glossaire_normalise or
+            _DOSE_RE.search(libelle_norm) or
+            self._detecter_patterns_medicaments(libelle_norm)):
+            return "MEDICAMENTS"
+        
+        # 2. Détection actes
+        if (self._detecter_patterns_actes(libelle_norm) or 
+            self._contient_terme_acte(libelle_norm)):
+            return "ACTES"
+        
+        return None
 
     def normalise(self, libelle_brut: str) -> str:
         """Normalise un libellé (point d'entrée principal)"""
@@ -287,45 +560,117 @@ class NormaliseurAMVAmeliore:
             return "INDÉTERMINÉ"
         
         cle = str(libelle_brut).upper().strip()
-        if cle in self.cache:
-            return self.cache[cle]
+        code = self._cache_lire(cle)
+        if code is not None:
+            return code
         
+        # Forme normalisée calculée une seule fois et partagée par tous les détecteurs
         libelle_norm = normaliser_accents(libelle_brut)
         
-        # 1. Détection médicaments
-        if (self._detecter_patterns_medicaments(libelle_brut) or 
-            libelle_norm in self.glossaire_normalise):
-            self.cache[cle] = "MEDICAMENTS"
-            return "MEDICAMENTS"
+        # Libellé sans lettre ni chiffre (« *** », « - ») : aucun détecteur ne peut répondre
+        if not libelle_norm:
+            self._cache_ecrire(cle, cle)
+            return cle
         
-        # 2. Détection actes
-        if (self._detecter_patterns_actes(libelle_brut) or 
-            any(terme in libelle_norm for terme in self.termes_actes)):
-            self.cache[cle] = "ACTES"
-            return "ACTES"
+        # 1-2. Patterns, glossaire et termes d'actes
+        code = self._classer_sans_fuzzy(libelle_norm)
+        if code is not None:
+            self._cache_ecrire(cle, code)
+            return code
         
         # 3. Recherche fuzzy si disponible
         if RAPIDFUZZ_AVAILABLE and self.glossaire_normalise:
+            if self._contient_cle_glossaire(libelle_norm):
+                self._cache_ecrire(cle, "MEDICAMENTS")
+                return "MEDICAMENTS"
             try:
-                match, score, _ = process.extractOne(
+                # score_cutoff : RapidFuzz abandonne les candidats qui ne peuvent plus atteindre le seuil
+                meilleur = process.extractOne(
                     libelle_norm, 
-                    list(self.glossaire_normalise.keys()), 
-                    scorer=fuzz.partial_ratio
+                    self._glossaire_cles, 
+                    scorer=fuzz.partial_ratio,
+                    processor=None,  # libellé et clés déjà passés par normaliser_accents
+                    score_cutoff=SEUIL_FUZZY_MEDICAMENTS
                 )
-                if score >= 85:
-                    self.cache[cle] = "MEDICAMENTS"
+                if meilleur is not None:
+                    self._cache_ecrire(cle, "MEDICAMENTS")
                     return "MEDICAMENTS"
-            except:
-                pass
+            except Exception as e:
+                logger.warning(f"Erreur fuzzy matching: {e}")
         
         # 4. Fallback
-        self.cache[cle] = cle
+        self._cache_ecrire(cle, cle)
         return cle
 
+    def _fuzzy_medicaments_batch(self, libelles_norm: List[str]) -> List[bool]:
+        """Fuzzy matching de plusieurs libellés contre le glossaire en un seul appel cdist"""
+        if not (RAPIDFUZZ_AVAILABLE and self._glossaire_cles):
+            return [False] * len(libelles_norm)
+        
+        # Clé du glossaire présente telle quelle : score de 100 sans passer par cdist
+        trouves = [self._contient_cle_glossaire(libelle_norm) for libelle_norm in libelles_norm]
+        restants = [i for i, trouve in enumerate(trouves) if not trouve]
+        if not restants:
+            return trouves
+        try:
+            scores = process.cdist(
+                [libelles_norm[i] for i in restants],
+                self._glossaire_cles,
+                scorer=fuzz.partial_ratio,
+                processor=None,
+                score_cutoff=SEUIL_FUZZY_MEDICAMENTS,
+                workers=-1
+            )
+            for i, score in zip(restants, scores.max(axis=1)):
+                trouves[i] = bool(score >= SEUIL_FUZZY_MEDICAMENTS)
+        except Exception as e:
+            logger.warning(f"Échec du fuzzy matching groupé: {e}")
+        return trouves
+
+    def normalise_batch(self, libelles: List[str]) -> List[str]:
+        """
+        Normalise une liste de libellés. Mêmes règles que normalise(), mais les
+        libellés non résolus par les étapes déterministes passent ensemble par
+        un unique process.cdist (C++ multi-thread, GIL relâché).
+        """
+        codes: List[Optional[str]] = []
+        en_attente: List[Tuple[int, str, str]] = []
+        
+        for i, libelle_brut in enumerate(libelles):
+            if not libelle_brut:
+                codes.append("INDÉTERMINÉ")
+                continue
+            
+            cle = str(libelle_brut).upper().strip()
+            code = self._cache_lire(cle)
+            if code is not None:
+                codes.append(code)
+                continue
+            
+            libelle_norm = normaliser_accents(libelle_brut)
+            code = self._classer_sans_fuzzy(libelle_norm) if libelle_norm else cle
+            if code is not None:
+                self._cache_ecrire(cle, code)
+            else:
+                en_attente.append((i, cle, libelle_norm))
+            codes.append(code)
+        
+        if en_attente:
+            trouves = self._fuzzy_medicaments_batch([libelle_norm for _, _, libelle_norm in en_attente])
+            for (i, cle, _), trouve in zip(en_attente, trouves):
+                code = "MEDICAMENTS" if trouve else cle
+                self._cache_ecrire(cle, code)
+                codes[i] = code
+        
+        return codes
+
     def get_mapping_stats(self) -> Dict[str, Any]:
         """Statistiques du normaliseur"""
         return {
             "cache_size": len(self.cache),
+            "cache_max": TAILLE_CACHE_NORMALISATION,
+            "cache_hits": self._cache_hits,
+            "cache_misses": self._cache_misses,
             "actes": len(self.termes_actes),
             "medicaments": len(self.termes_medicaments),
             "glossaire_normalise": len(self.glossaire_normalise),
@@ -360,6 +705,13 @@ class PennyPetProcessor:
             # Normaliseur
             self.normaliseur = NormaliseurAMVAmeliore(self.config)
             
+            # Barèmes indexés par formule une fois pour toutes (lookup O(1) par ligne)
+            self.baremes = self._indexer_baremes(getattr(self.config, "regles_pc_df", None))
+            
+            # Cache des résultats complets (évite un nouvel appel LLM sur une facture identique)
+            self._result_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+            self._result_cache_lock = threading.Lock()
+            
             # Stats
             self.stats = {
                 'lignes_traitees': 0,
@@ -374,17 +726,43 @@ class PennyPetProcessor:
             logger.error(f"Erreur initialisation: {e}")
             raise
 
+    @staticmethod
+    def _indexer_baremes(regles_df: Optional[pd.DataFrame]) -> Dict[str, Tuple[float, float, int]]:
+        """Construit la table formule → barème depuis les règles de prise en charge (repli sur BAREMES_PENNYPET)"""
+        baremes = dict(BAREMES_PENNYPET)
+        if regles_df is None or regles_df.empty:
+            return baremes
+        try:
+            for regle in regles_df.itertuples(index=False):
+                couverture = TYPES_COUVERTURE.get(str(regle.type_couverture).strip().upper())
+                if couverture is None:
+                    logger.warning(f"Type de couverture inconnu pour {regle.formule}: {regle.type_couverture}")
+                    continue
+                baremes[str(regle.formule).strip().upper()] = (
+                    float(regle.taux_remboursement) / 100,
+                    float(regle.plafond_annuel),
+                    couverture,
+                )
+        except Exception as e:
+            logger.error(f"Règles de prise en charge inexploitables, barèmes par défaut: {e}")
+            return dict(BAREMES_PENNYPET)
+        return baremes
+
     def _calculer_remboursement_pennypet(self, montant: float, formule: str, est_accident: bool) -> float:
         """Calcule le remboursement selon les vraies règles PennyPet"""
-        if formule == "START":
+        return self._appliquer_bareme(montant, self.baremes.get(formule), est_accident)
+
+    @staticmethod
+    def _appliquer_bareme(
+        montant: float, bareme: Optional[Tuple[float, float, int]], est_accident: bool
+    ) -> float:
+        """Applique un barème déjà résolu pour la formule (0 si formule inconnue ou non couverte)"""
+        if bareme is None:
             return 0
-        elif formule == "PREMIUM":
-            return min(montant, 500) if est_accident else 0
-        elif formule == "INTEGRAL":
-            return min(montant * 0.5, 1000)
-        elif formule == "INTEGRAL_PLUS":
-            return min(montant, 1000)
-        return 0
+        taux, plafond, couverture = bareme
+        if not couverture & (COUVERTURE_ACCIDENT if est_accident else COUVERTURE_MALADIE):
+            return 0
+        return min(montant * taux, plafond)
 
     def extract_lignes_from_image(
         self, image_bytes: bytes, formule: str, llm_provider: str = "qwen"
@@ -399,9 +777,18 @@ class PennyPetProcessor:
             else:
                 raise ValueError(f"Client {llm_provider} indisponible")
             
-            # Appel LLM
-            resp = client.analyze_invoice_image(image_bytes, formule)
-            content = resp.choices[0].message.content
+            # Appel LLM : streaming avec le client OpenRouter (on coupe dès que le JSON est complet).
+            # Ses reprises ne couvrent que l'ouverture du flux : en cas de coupure ou d'erreur en
+            # cours de lecture, repli sur l'appel complet, qui réessaie la requête entière
+            content = None
+            if isinstance(client, OpenRouterClient):
+                try:
+                    content = _lire_json_en_flux(client.analyze_invoice_image_stream(image_bytes, formule))
+                except Exception as e:
+                    logger.warning(f"Échec du streaming LLM, repli sur l'appel complet: {e}")
+            if content is None:
+                resp = client.analyze_invoice_image(image_bytes, formule)
+                content = resp.choices[0].message.content
             
             if not content:
                 raise ValueError("Réponse LLM vide")
@@ -429,13 +816,98 @@ class PennyPetProcessor:
             logger.error(f"Erreur extraction: {e}")
             raise
 
+    @staticmethod
+    def _libelle_ligne(ligne: Dict[str, Any]) -> str:
+        """Libellé utilisé pour la normalisation (code_acte, sinon description)"""
+        return (ligne.get("code_acte") or ligne.get("description", "")).strip()
+
+    def _normaliser_libelles(self, lignes: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Normalise une seule fois chaque libellé distinct de la facture, en un
+        seul lot, et renvoie la table libellé → code.
+        """
+        uniques = set()
+        for ligne in lignes:
+            try:
+                uniques.add(self._libelle_ligne(ligne))
+            except Exception:
+                continue  # l'erreur sera comptabilisée au traitement de la ligne
+        uniques = list(uniques)
+        
+        try:
+            return dict(zip(uniques, self.normaliseur.normalise_batch(uniques)))
+        except Exception as e:
+            logger.warning(f"Normalisation groupée impossible, repli ligne à ligne: {e}")
+            return {}
+
+    def _traiter_ligne(
+        self,
+        ligne: Dict[str, Any],
+        bareme: Optional[Tuple[float, float, int]],
+        normalisations: Dict[str, str],
+    ) -> Optional[Dict[str, Any]]:
+        """Calcule le remboursement d'une ligne (None si montant nul)"""
+        libelle = self._libelle_ligne(ligne)
+        # montant_ht déjà converti en float par extract_lignes_from_image
+        montant = ligne.get("montant_ht", 0.0)
+        
+        if montant <= 0:
+            return None
+        
+        # Normalisation (pré-calculée par libellé distinct)
+        code_norm = normalisations.get(libelle) or self.normaliseur.normalise(libelle)
+        est_medicament = (code_norm == "MEDICAMENTS")
+        
+        # Détection accident
+        est_accident = _ACCIDENT_RE.search(libelle) is not None
+        
+        # Calcul remboursement
+        remboursement = self._appliquer_bareme(montant, bareme, est_accident)
+        
+        return {
+            # Forme fixe à 4 clés : les champs supplémentaires du JSON LLM ne sont pas exposés
+            "ligne": {
+                "code_acte": ligne.get("code_acte", ""),
+                "description": ligne.get("description", ""),
+                "montant_ht": montant,
+                "est_medicament": est_medicament
+            },
+            "code_normalise": code_norm,
+            "est_accident": est_accident,
+            "montant_rembourse": remboursement,
+            "montant_reste_charge": montant - remboursement,
+            "taux_remboursement": (remboursement / montant * 100) if montant > 0 else 0
+        }
+
+    @staticmethod
+    def _cle_cache_resultat(file_bytes: bytes, formule_client: str, llm_provider: str) -> str:
+        """Clé de cache : blake2b du fichier, indexée par formule et modèle"""
+        return hashlib.blake2b(
+            file_bytes,
+            digest_size=16,
+            key=f"{formule_client}|{llm_provider.lower()}".encode("utf-8")[:64]
+        ).hexdigest()
+
     def process_facture_pennypet(
         self, file_bytes: bytes, formule_client: str, llm_provider: str = "qwen"
     ) -> Dict[str, Any]:
         """Traitement complet d'une facture"""
         
-        # Reset stats
-        self.stats = {
+        # Facture déjà traitée avec la même formule et le même modèle
+        cle_cache = self._cle_cache_resultat(file_bytes, formule_client, llm_provider)
+        with self._result_cache_lock:
+            cached = self._result_cache.get(cle_cache)
+            if cached is not None:
+                self._result_cache.move_to_end(cle_cache)
+        if cached is not None:
+            logger.info("Facture déjà traitée, résultat servi depuis le cache")
+            # Copie : l'appelant peut modifier le résultat sans altérer le cache
+            resultat_facture = copy.deepcopy(cached)
+            self.stats = dict(resultat_facture["statistiques"])
+            return resultat_facture
+        
+        # Statistiques propres à cette facture (l'instance est partagée entre sessions)
+        stats = {
             'lignes_traitees': 0,
             'medicaments_detectes': 0,
             'actes_detectes': 0,
@@ -446,62 +918,41 @@ class PennyPetProcessor:
             # Extraction
             data, raw_content = self.extract_lignes_from_image(file_bytes, formule_client, llm_provider)
             
-            resultats = []
-            accidents = {"accident", "urgent", "urgence", "fract", "trauma", "traumatisme"}
+            # Normalisation groupée des libellés distincts
+            lignes = data["lignes"]
+            normalisations = self._normaliser_libelles(lignes)
             
-            # Traitement des lignes
-            for ligne in data["lignes"]:
+            # Barème de la formule résolu une fois pour toute la facture
+            bareme = self.baremes.get(formule_client)
+            
+            # Traitement des lignes (montants collectés dans la même passe que les totaux)
+            resultats = []
+            montants, rembourses = [], []
+            for ligne in lignes:
                 try:
-                    libelle = (ligne.get("code_acte") or ligne.get("description", "")).strip()
-                    montant = float(ligne.get("montant_ht", 0) or 0)
-                    
-                    if montant <= 0:
-                        continue
-                    
-                    # Normalisation
-                    code_norm = self.normaliseur.normalise(libelle)
-                    est_medicament = (code_norm == "MEDICAMENTS")
-                    
-                    # Détection accident
-                    est_accident = any(mot in libelle.lower() for mot in accidents)
-                    
-                    # Calcul remboursement
-                    remboursement = self._calculer_remboursement_pennypet(montant, formule_client, est_accident)
-                    
-                    # Stats
-                    self.stats['lignes_traitees'] += 1
-                    if est_medicament:
-                        self.stats['medicaments_detectes'] += 1
-                    else:
-                        self.stats['actes_detectes'] += 1
-                    
-                    # Résultat
-                    resultat = {
-                        "ligne": {
-                            "code_acte": ligne.get("code_acte", ""),
-                            "description": ligne.get("description", ""),
-                            "montant_ht": montant,
-                            "est_medicament": est_medicament
-                        },
-                        "code_normalise": code_norm,
-                        "est_accident": est_accident,
-                        "montant_rembourse": remboursement,
-                        "montant_reste_charge": montant - remboursement,
-                        "taux_remboursement": (remboursement / montant * 100) if montant > 0 else 0
-                    }
-                    
-                    resultats.append(resultat)
-                    
+                    resultat = self._traiter_ligne(ligne, bareme, normalisations)
                 except Exception as e:
-                    self.stats['erreurs_normalisation'] += 1
+                    stats['erreurs_normalisation'] += 1
                     logger.error(f"Erreur traitement ligne: {e}")
                     continue
+                if resultat is None:
+                    continue
+                
+                stats['lignes_traitees'] += 1
+                if resultat["ligne"]["est_medicament"]:
+                    stats['medicaments_detectes'] += 1
+                else:
+                    stats['actes_detectes'] += 1
+                
+                resultats.append(resultat)
+                montants.append(resultat["ligne"]["montant_ht"])
+                rembourses.append(resultat["montant_rembourse"])
             
             # Totaux
-            total_facture = sum(r["ligne"]["montant_ht"] for r in resultats)
-            total_rembourse = sum(r["montant_rembourse"] for r in resultats)
+            total_facture = math.fsum(montants)
+            total_rembourse = math.fsum(rembourses)
             
-            return {
+            resultat_facture = {
                 "success": True,
                 "lignes": resultats,
                 "resume": {
@@ -511,18 +962,33 @@ class PennyPetProcessor:
                     "taux_remboursement_global": (total_rembourse / total_facture * 100) if total_facture > 0 else 0
                 },
                 "informations_client": data.get("informations_client", {}),
-                "statistiques": self.stats,
+                "statistiques": dict(stats),
                 "mapping_stats": self.normaliseur.get_mapping_stats(),
                 "raw_llm_response": raw_content
             }
             
+            # Seul un JSON réellement décodé est mis en cache : après une réponse illisible
+            # (fallback regex) ou sans ligne exploitable, un nouvel envoi doit rappeler le LLM
+            if resultats and not data.get("parsing_degrade"):
+                with self._result_cache_lock:
+                    self._result_cache[cle_cache] = copy.deepcopy(resultat_facture)
+                    if len(self._result_cache) > TAILLE_CACHE_RESULTATS:
+                        self._result_cache.popitem(last=False)
+            
+            self.stats = stats
+            return resultat_facture
+            
         except Exception as e:
             logger.error(f"Erreur process_facture_pennypet: {e}")
+            self.stats = stats
             return {
                 "success": False,
                 "error": str(e),
-                "statistiques": self.stats
+                "statistiques": dict(stats)
             }
 
-# Instance globale
-pennypet_processor = PennyPetProcessor()
+# Instance globale, créée au premier usage (pas de lecture de configuration à l'import)
+@functools.lru_cache(maxsize=None)
+def get_pennypet_processor() -> PennyPetProcessor:
+    """Renvoie l'instance partagée de PennyPetProcessor"""
+    return PennyPetProcessor()
@@ -5,7 +5,7 @@ import time
 import random
 import json
 import logging
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Iterator, Optional, Union
 import fitz  # PyMuPDF
 from pdf2image import convert_from_bytes
 import io
@@ -193,6 +193,45 @@ RÈGLES SPECIFIQUES PENNYPET:
 IMPORTANT: Répondez UNIQUEMENT avec du JSON valide, sans texte explicatif avant ou après.
 """
 
+    def _build_invoice_messages(self, image_bytes: bytes, formule_client: str) -> List[Dict[str, Any]]:
+        """Prépare les messages (prompt + image encodée) pour l'analyse d'une facture"""
+        # Vérifier et convertir si PDF
+        if self._is_pdf(image_bytes):
+            logger.info("PDF détecté, conversion en image...")
+            image_bytes = self._convert_pdf_to_image(image_bytes)
+        
+        # Optimiser l'image
+        image_bytes = self._optimize_image(image_bytes)
+        
+        # Encoder en base64
+        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        
+        # Préparer le prompt amélioré
+        prompt = self.get_improved_prompt(formule_client)
+        
+        # Messages structurés
+        return [
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Analysez cette facture vétérinaire et extrayez toutes les informations selon le format JSON demandé."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{image_base64}"
+                        }
+                    }
+                ]
+            }
+        ]
+
     def chat(
         self,
         messages: List[Dict[str, Union[str, list, dict]]],
@@ -226,6 +265,54 @@ IMPORTANT: Répondez UNIQUEMENT avec du JSON valide, sans texte explicatif avant
         
         raise RuntimeError(f"OpenRouter API failed after {retries} attempts: {last_exception}")
 
+    def chat_stream(
+        self,
+        messages: List[Dict[str, Union[str, list, dict]]],
+        temperature: float = 0.1,
+        max_tokens: int = 4000,
+        stop: Optional[List[str]] = None,
+        retries: int = 3
+    ) -> Iterator[str]:
+        """
+        Streaming (SSE) variant of chat: yields content deltas as they arrive.
+        Retries only apply to opening the stream. Closing the generator closes
+        the underlying HTTP response.
+        """
+        params: Dict[str, Any] = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        if stop:
+            params["stop"] = stop
+
+        stream = None
+        last_exception = None
+        for attempt in range(retries):
+            try:
+                stream = self.client.chat.completions.create(**params)
+                break
+            except Exception as e:
+                last_exception = e
+                wait_time = 2 ** attempt + random.uniform(0, 1)
+                logger.warning(f"Tentative {attempt + 1}/{retries} échouée: {e}")
+                time.sleep(wait_time)
+
+        if stream is None:
+            raise RuntimeError(f"OpenRouter API failed after {retries} attempts: {last_exception}")
+
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
     def analyze_invoice_image(
         self,
         image_bytes: bytes,
@@ -238,42 +325,7 @@ IMPORTANT: Répondez UNIQUEMENT avec du JSON valide, sans texte explicatif avant
         Analyse une image de facture avec gestion PDF améliorée et validation JSON.
         """
         try:
-            # Vérifier et convertir si PDF
-            if self._is_pdf(image_bytes):
-                logger.info("PDF détecté, conversion en image...")
-                image_bytes = self._convert_pdf_to_image(image_bytes)
-            
-            # Optimiser l'image
-            image_bytes = self._optimize_image(image_bytes)
-            
-            # Encoder en base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
-            # Préparer le prompt amélioré
-            prompt = self.get_improved_prompt(formule_client)
-            
-            # Messages structurés
-            messages = [
-                {
-                    "role": "system",
-                    "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Analysez cette facture vétérinaire et extrayez toutes les informations selon le format JSON demandé."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
-                        }
-                    ]
-                }
-            ]
+            messages = self._build_invoice_messages(image_bytes, formule_client)
             
             # Appel API avec retry
             response = self.chat(
@@ -290,6 +342,26 @@ IMPORTANT: Répondez UNIQUEMENT avec du JSON valide, sans texte explicatif avant
             logger.error(f"Erreur lors de l'analyse: {e}")
             raise
 
+    def analyze_invoice_image_stream(
+        self,
+        image_bytes: bytes,
+        formule_client: str,
+        temperature: float = 0.1,
+        max_tokens: int = 4000,
+        retries: int = 3
+    ) -> Iterator[str]:
+        """
+        Variante streaming de analyze_invoice_image : renvoie les fragments de
+        texte au fil de l'eau pour permettre l'extraction JSON incrémentale.
+        """
+        messages = self._build_invoice_messages(image_bytes, formule_client)
+        return self.chat_stream(
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            retries=retries
+        )
+
     def extract_and_validate_response(self, response: Any) -> Dict[str, Any]:
         """
         Extrait et valide la réponse JSON du LLM.
@@ -33,3 +33,19 @@ def processor(config, mocker):
         client_mistral=mock_client,
         config=config
     )
+
+@pytest.fixture
+def processeur_factice(config, mocker):
+    """Fabrique un processor dont le client LLM renvoie le contenu JSON fourni."""
+    class DummyResponse:
+        def __init__(self, content): self.choices = [type("C", (), {"message": type("M", (), {"content": content})})]
+
+    def _build(contenu: str) -> PennyPetProcessor:
+        mock_client = mocker.Mock(spec=["analyze_invoice_image"])
+        mock_client.analyze_invoice_image.return_value = DummyResponse(contenu)
+        return PennyPetProcessor(
+            client_qwen=mock_client,
+            client_mistral=mock_client,
+            config=config
+        )
+    return _build
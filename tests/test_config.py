@@ -12,3 +12,13 @@ def test_medicaments_loaded(config):
 def test_mapping_et_formules(config):
     assert isinstance(config.mapping_amv, dict)
     assert "INTEGRAL" in config.formules
+
+def test_regles_listes_en_frozenset(config):
+    actes = config.regles_pc_df.set_index("formule")["actes_couverts"]
+    assert isinstance(actes["INTEGRAL"], frozenset)
+    assert "MEDICAMENTS" in actes["INTEGRAL"]
+    assert "CONSULTATION_URGENCE" in actes["PREMIUM"]
+
+def test_regles_colonnes_filtrage_category(config):
+    assert config.regles_pc_df["formule"].dtype == "category"
+    assert (config.regles_pc_df["formule"] == "PREMIUM").sum() == 1
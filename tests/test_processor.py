@@ -1,3 +1,11 @@
+import copy
+import json
+import pandas as pd
+import pytest
+from openrouter_client import OpenRouterClient
+import llm_parser.pennypet_processor as module_processor
+from llm_parser.pennypet_processor import NormaliseurAMVAmeliore, PennyPetProcessor, parse_llm_json
+
 def test_identifier_actes(processor):
     actes = processor.identifier_actes_sur_facture("texte factice")
     # Selon vos données de config, vérifiez que le résultat est une liste
@@ -13,3 +21,179 @@ def test_extraction_et_remboursement(processor):
     assert "texte_ocr" in result
     assert result["montant_total"] == 10.0
     assert "remboursement_pennypet" in result
+
+def test_lignes_traitees_dans_l_ordre_sans_montant_nul(processeur_factice):
+    lignes = [
+        {"code_acte": f"Consultation {i}", "description": "acte", "montant_ht": 10.0}
+        for i in range(12)
+    ]
+    lignes.append({"code_acte": "Ligne gratuite", "description": "", "montant_ht": 0})
+    processor = processeur_factice(json.dumps({"lignes": lignes}))
+    result = processor.process_facture_pennypet(
+        file_bytes=b"%PDF",
+        formule_client="INTEGRAL",
+        llm_provider="qwen"
+    )
+    assert result["success"]
+    assert result["statistiques"]["lignes_traitees"] == 12
+    assert [r["ligne"]["code_acte"] for r in result["lignes"]] == [f"Consultation {i}" for i in range(12)]
+    assert result["resume"]["total_rembourse"] == 60.0
+
+def test_lecture_json_en_flux_coupe_apres_objet(config, mocker):
+    fragments = ['Voici: {"lignes": [{"code_acte": "Vaccin {rage}", ', '"montant_ht": 45.5}]}', ' texte en trop {', '}']
+    consommes = []
+
+    def flux(*args, **kwargs):
+        for fragment in fragments:
+            consommes.append(fragment)
+            yield fragment
+
+    client = mocker.Mock(spec=OpenRouterClient)
+    client.analyze_invoice_image_stream.side_effect = flux
+    processor = PennyPetProcessor(client_qwen=client, client_mistral=client, config=config)
+
+    data, contenu = processor.extract_lignes_from_image(b"img", "INTEGRAL", "qwen")
+    assert contenu.endswith('45.5}]}')
+    assert data["lignes"][0]["code_acte"] == "Vaccin {rage}"
+    assert len(consommes) == 2
+
+def test_flux_interrompu_repli_sur_appel_complet(config, mocker):
+    def flux(*args, **kwargs):
+        yield '{"lignes": [{"code_acte": "Vaccin", '
+        raise ConnectionError("connexion interrompue")
+
+    client = mocker.Mock(spec=OpenRouterClient)
+    client.analyze_invoice_image_stream.side_effect = flux
+    contenu = '{"lignes": [{"code_acte": "Vaccin", "montant_ht": 45.5}]}'
+    client.analyze_invoice_image.return_value = mocker.Mock(choices=[mocker.Mock(message=mocker.Mock(content=contenu))])
+    processor = PennyPetProcessor(client_qwen=client, client_mistral=client, config=config)
+
+    data, _ = processor.extract_lignes_from_image(b"img", "INTEGRAL", "qwen")
+    assert data["lignes"][0]["montant_ht"] == 45.5
+    assert client.analyze_invoice_image.call_count == 1
+
+def test_ligne_resultat_forme_fixe(processeur_factice):
+    processor = processeur_factice(
+        '{"lignes":[{"animal_uid":"A1","code_acte":"Consultation","description":"acte","montant_ht":30.0}]}'
+    )
+    result = processor.process_facture_pennypet(b"%PDF", "INTEGRAL", "qwen")
+    assert result["lignes"][0]["ligne"] == {
+        "code_acte": "Consultation", "description": "acte", "montant_ht": 30.0, "est_medicament": False
+    }
+
+def test_facture_identique_servie_depuis_cache(processeur_factice):
+    processor = processeur_factice('{"lignes":[{"code_acte":"Consultation","description":"acte","montant_ht":30.0}]}')
+    premier = processor.process_facture_pennypet(b"%PDF-1", "INTEGRAL", "qwen")
+    second = processor.process_facture_pennypet(b"%PDF-1", "INTEGRAL", "qwen")
+    assert second == premier and second is not premier
+    assert processor.client_qwen.analyze_invoice_image.call_count == 1
+
+    # Le cache rend une copie : les modifications de l'appelant ne le corrompent pas
+    second["statistiques"]["lignes_traitees"] = 99
+    second["lignes"].clear()
+    assert processor.process_facture_pennypet(b"%PDF-1", "INTEGRAL", "qwen") == premier
+
+    processor.process_facture_pennypet(b"%PDF-1", "PREMIUM", "qwen")
+    assert processor.client_qwen.analyze_invoice_image.call_count == 2
+
+@pytest.mark.parametrize("formule, montant, est_accident, attendu", [
+    ("START", 200.0, True, 0),
+    ("PREMIUM", 200.0, False, 0),
+    ("PREMIUM", 800.0, True, 500.0),
+    ("INTEGRAL", 200.0, False, 100.0),
+    ("INTEGRAL", 3000.0, False, 1000.0),
+    ("INTEGRAL_PLUS", 200.0, False, 200.0),
+    ("INCONNUE", 200.0, True, 0),
+])
+def test_calcul_remboursement_par_formule(processeur_factice, formule, montant, est_accident, attendu):
+    processor = processeur_factice('{"lignes":[]}')
+    assert processor._calculer_remboursement_pennypet(montant, formule, est_accident) == attendu
+
+def test_libelles_identiques_normalises_une_fois(processeur_factice, mocker):
+    lignes = [{"code_acte": "Consultation", "description": "", "montant_ht": 20.0}] * 3
+    lignes.append({"code_acte": "Vaccin rage", "description": "", "montant_ht": 40.0})
+    processor = processeur_factice(json.dumps({"lignes": lignes}))
+    espion = mocker.spy(processor.normaliseur, "normalise_batch")
+
+    result = processor.process_facture_pennypet(b"%PDF", "INTEGRAL", "qwen")
+    assert result["statistiques"]["lignes_traitees"] == 4
+    assert espion.call_count == 1
+    assert sorted(espion.call_args.args[0]) == ["Consultation", "Vaccin rage"]
+
+def test_normalise_batch_identique_a_normalise(config):
+    libelles = ["Consultation", "Metacam 1,5 mg/ml", "Frais de dossier", "", "Vaccin rage", "Metacam"]
+    attendu = [NormaliseurAMVAmeliore(config).normalise(l) for l in libelles]
+    assert NormaliseurAMVAmeliore(config).normalise_batch(libelles) == attendu
+
+def test_parse_llm_json_valide_et_repare():
+    valide = parse_llm_json('Réponse : {"lignes": [{"code_acte": "Vaccin", "montant_ht": 45.0}]} fin')
+    assert valide["lignes"][0]["montant_ht"] == 45.0
+
+    repare = parse_llm_json('{lignes: [{"code_acte": "A", "montant_ht": 1.0} {"code_acte": "B", "montant_ht": 2.0},]}')
+    assert [l["code_acte"] for l in repare["lignes"]] == ["A", "B"]
+
+def test_cache_normalisation_borne(config, monkeypatch):
+    monkeypatch.setattr(module_processor, "TAILLE_CACHE_NORMALISATION", 2)
+    normaliseur = NormaliseurAMVAmeliore(config)
+    for libelle in ["Consultation", "Vaccin rage", "Frais de dossier"]:
+        normaliseur.normalise(libelle)
+    assert list(normaliseur.cache) == ["VACCIN RAGE", "FRAIS DE DOSSIER"]
+    normaliseur.normalise("Vaccin rage")
+    assert normaliseur.get_mapping_stats()["cache_hits"] == 1
+
+def test_baremes_indexes_depuis_regles(config, mocker):
+    config_modifiee = copy.copy(config)
+    config_modifiee.regles_pc_df = pd.DataFrame([
+        {"formule": "INTEGRAL", "type_couverture": "ACCIDENT_MALADIE", "taux_remboursement": 80, "plafond_annuel": 1500},
+        {"formule": "PREMIUM", "type_couverture": "DENTAIRE", "taux_remboursement": 10, "plafond_annuel": 50},
+    ])
+    client = mocker.Mock(spec=["analyze_invoice_image"])
+    processor = PennyPetProcessor(client_qwen=client, client_mistral=client, config=config_modifiee)
+
+    couverture_complete = module_processor.COUVERTURE_ACCIDENT | module_processor.COUVERTURE_MALADIE
+    assert processor.baremes["INTEGRAL"] == (0.8, 1500.0, couverture_complete)
+    # Type de couverture inconnu : ligne ignorée, barème par défaut conservé
+    assert processor.baremes["PREMIUM"] == module_processor.BAREMES_PENNYPET["PREMIUM"]
+    assert processor._calculer_remboursement_pennypet(1000.0, "INTEGRAL", False) == 800.0
+
+def test_parse_llm_json_valide_decode_sans_nettoyage():
+    brut = 'Voici : {"lignes": [{"code_acte": "Soin de l\'oreille", "remarque": "dose, matin: 1"}]} (fin})'
+    data = parse_llm_json(brut)
+    assert data["lignes"][0] == {"code_acte": "Soin de l'oreille", "remarque": "dose, matin: 1"}
+
+def test_fallback_regex_parser_conserve_toutes_les_lignes():
+    lignes = lambda data: [(l["code_acte"], l["montant_ht"]) for l in data["lignes"]]
+
+    assert module_processor._fallback_regex_parser("a" * 50000)["lignes"][0]["code_acte"] == "ERREUR_JSON"
+    assert lignes(module_processor._fallback_regex_parser("Consultation: 40 Vaccin: 25")) == [
+        ("Consultation", 40.0), ("Vaccin", 25.0)
+    ]
+    assert lignes(module_processor._fallback_regex_parser("Total: 65 (Consultation: 40 / Vaccin: 25)")) == [
+        ("Total", 65.0), ("(Consultation", 40.0), ("/ Vaccin", 25.0)
+    ]
+
+    # Réponse tronquée : une description longue ne fait pas perdre sa ligne
+    tronquee = (
+        '{"lignes": [{"code_acte": "Consultation", "montant_ht": 40}, '
+        '{"code_acte": "Détartrage", "description": "' + "x" * 224 + '", "montant_ht": 180}, '
+        '{"code_acte": "Vacc'
+    )
+    assert lignes(parse_llm_json(tronquee)) == [("Consultation", 40.0), ("Détartrage", 180.0)]
+
+def test_import_du_module_sans_instance_partagee():
+    # L'import lie bien le sous-module et ne construit pas l'instance partagée
+    assert module_processor.__name__ == "llm_parser.pennypet_processor"
+    assert module_processor.get_pennypet_processor.cache_info().currsize == 0
+
+def test_reponse_illisible_non_mise_en_cache(processeur_factice):
+    processor = processeur_factice("désolé, je ne peux pas lire")
+    client = processor.client_qwen
+    premier = processor.process_facture_pennypet(b"x", "INTEGRAL", "qwen")
+    assert premier["lignes"] == []
+
+    client.analyze_invoice_image.return_value.choices[0].message.content = (
+        '{"lignes":[{"code_acte":"Consultation","description":"acte","montant_ht":30.0}]}'
+    )
+    second = processor.process_facture_pennypet(b"x", "INTEGRAL", "qwen")
+    assert client.analyze_invoice_image.call_count == 2
+    assert len(second["lignes"]) == 1
@@ -12,7 +12,7 @@ import json
 import re
 from datetime import datetime
 from supabase import create_client
-from llm_parser.pennypet_processor import PennyPetProcessor
+from llm_parser.pennypet_processor import get_pennypet_processor
 
 # Configuration de la page
 st.set_page_config(
@@ -251,6 +251,10 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Fonction parse_llm_json locale pour le debug
+JSON_DECODER = json.JSONDecoder()
+CLE_NON_QUOTEE_RE = re.compile(r'([{,]\s*)([a-zA-Z0-9_]+)\s*:')
+VIRGULE_AVANT_FERMANTE_RE = re.compile(r',\s*([}\]])')
+
 def parse_llm_json(content: str) -> dict:
     """Parse JSON depuis la réponse LLM avec nettoyage robuste"""
     try:
@@ -262,26 +266,25 @@ def parse_llm_json(content: str) -> dict:
         if start < 0:
             raise ValueError("Pas de JSON trouvé")
         
-        depth = 0
-        json_str = None
-        for i, ch in enumerate(content[start:], start):
-            if ch == "{":
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0:
-                    json_str = content[start : i + 1]
-                    break
+        # Décodage direct par le tokenizer C de json (gère les accolades dans les chaînes)
+        try:
+            data, _ = JSON_DECODER.raw_decode(content, start)
+            return data
+        except json.JSONDecodeError:
+            pass
         
-        if not json_str:
+        end = content.rfind("}")
+        if end <= start:
             raise ValueError("JSON malformé")
+        json_str = content[start : end + 1]
         
         # Nettoyage du JSON
-        json_str = re.sub(r'([{,]\s*)([a-zA-Z0-9_]+)\s*:', r'\1"\2":', json_str)
+        json_str = CLE_NON_QUOTEE_RE.sub(r'\1"\2":', json_str)
         json_str = json_str.replace("'", '"')
-        json_str = re.sub(r',\s*([}\]])', r'\1', json_str)
+        json_str = VIRGULE_AVANT_FERMANTE_RE.sub(r'\1', json_str)
         
-        return json.loads(json_str)
+        data, _ = JSON_DECODER.raw_decode(json_str)
+        return data
     except Exception as e:
         raise ValueError(f"Erreur parsing JSON: {e}")
 
@@ -445,7 +448,8 @@ with tab1:
             display_pennypet_alert("⚠️ Le fichier est vide ou corrompu.", "error", "😔")
             st.stop()
         
-        processor = PennyPetProcessor()
+        # Instance partagée entre les reruns et les sessions (conserve le cache des factures)
+        processor = get_pennypet_processor()
         
         try:
             with st.spinner("🔍 L'IA PennyPet analyse ta facture..."):